@@ -1,68 +1,316 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify, render_template_string
 from flask_cors import CORS
+from flask_caching import Cache
+from flask_compress import Compress
 import requests
-import json
+from requests.adapters import HTTPAdapter
+import math
+import numpy as np
+import orjson
+import os
+import queue
 import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
 
 app = Flask(__name__)
 CORS(app)
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 60})
+app.config['COMPRESS_MIN_SIZE'] = 500  # bytes; smaller responses aren't worth gzipping
+Compress(app)
 
 # Configuration
 MAPBOX_ACCESS_TOKEN = 'YOUR_MAPBOX_ACCESS_TOKEN'
 MAPBOX_DIRECTIONS_URL = 'https://api.mapbox.com/directions/v5/mapbox/walking'
+DATABASE_PATH = 'pathvision.db'
+EARTH_RADIUS = 6371000  # meters; shared by distances, bounding boxes and the grid
+AR_OVERLAY_RADIUS = 100  # meters
+AR_GRID_CELL_SIZE = 50  # meters of latitude per AR overlay grid cell
+AR_GRID_CELL_DEGREES = math.degrees(AR_GRID_CELL_SIZE / EARTH_RADIUS)
+MAPBOX_TIMEOUT = 5  # seconds
+ROUTE_CACHE_TIMEOUT = 300  # seconds to reuse a Mapbox route
+LOG_BATCH_SIZE = 100  # navigation logs per write transaction
+LOG_FLUSH_INTERVAL = 0.1  # seconds to wait for a batch to fill
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', os.cpu_count() or 4))  # read-only connections
+DB_STATEMENT_CACHE_SIZE = 256  # prepared statements kept per pooled connection
+
+# SQL statements
+# Request-path queries are fixed strings so each pooled connection's statement
+# cache can reuse the prepared statement instead of re-parsing it every call
+
+# Matches pois_rtree entries overlapping a (min_lat, max_lat, min_lon, max_lon)
+# box. R-tree coordinates are rounded outward to 32-bit floats, so an overlap
+# test never drops a point that lies inside the box
+RTREE_BOX_FILTER = 'r.maxLat >= ? AND r.minLat <= ? AND r.maxLon >= ? AND r.minLon <= ?'
+
+SQL_POI_SELECT = '''
+    SELECT p.id, p.name, p.category, p.latitude, p.longitude, p.description, p.indoor_map
+    FROM pois p
+'''
+
+# Analytics read the counters maintained by the log writer rather than
+# aggregating navigation_logs on every request
+SQL_POPULAR_DESTINATIONS = '''
+    SELECT end_location, count
+    FROM dest_counts
+    ORDER BY count DESC
+    LIMIT 5
+'''
+
+SQL_TOTAL_NAVIGATIONS = "SELECT value FROM navigation_stats WHERE name = 'total_navigations'"
+
+SQL_INSERT_LOG = '''
+    INSERT INTO navigation_logs (user_id, start_location, end_location, timestamp, route_blob)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+SQL_ADD_DEST_COUNT = '''
+    INSERT INTO dest_counts (end_location, count) VALUES (?, ?)
+    ON CONFLICT(end_location) DO UPDATE SET count = count + excluded.count
+'''
+
+SQL_ADD_TOTAL_NAVIGATIONS = "UPDATE navigation_stats SET value = value + ? WHERE name = 'total_navigations'"
+
+# Keep-alive session so Mapbox calls reuse TCP/TLS connections
+MAPBOX_SESSION = requests.Session()
+MAPBOX_SESSION.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=64))
+
+# Applied to every new connection; busy_timeout waits out lock contention
+SQLITE_PRAGMAS = [
+    'busy_timeout=5000',
+    'cache_size=-20000',
+    'temp_store=MEMORY',
+    'foreign_keys=ON',
+]
+# WAL lets readers run alongside the single writer and NORMAL sync batches fsyncs
+SQLITE_WRITER_PRAGMAS = ['journal_mode=WAL', 'synchronous=NORMAL'] + SQLITE_PRAGMAS
+
+# Database connection pool
+class ConnectionPool:
+    """Fixed-size pool of SQLite connections shared across request threads"""
+
+    def __init__(self, database, size, pragmas=()):
+        self.database = database
+        self.pragmas = list(pragmas)
+        self._connections = queue.LifoQueue(maxsize=size)
+        # Slots start empty and are filled with real connections on first use
+        for _ in range(size):
+            self._connections.put(None)
+
+    def _create_connection(self):
+        # IMMEDIATE takes the write lock when a write transaction begins
+        # instead of failing with SQLITE_BUSY when upgrading mid-transaction
+        conn = sqlite3.connect(self.database, check_same_thread=False,
+                               isolation_level='IMMEDIATE', uri=True,
+                               cached_statements=DB_STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        for pragma in self.pragmas:
+            conn.execute(f'PRAGMA {pragma}')
+        return conn
+
+    @contextmanager
+    def connect(self):
+        """Borrow a connection, returning it to the pool when done"""
+        conn = self._connections.get()
+        if conn is None:
+            try:
+                conn = self._create_connection()
+            except BaseException:
+                # Give the slot back so a failed open doesn't shrink the pool
+                self._connections.put(None)
+                raise
+        try:
+            yield conn
+        finally:
+            # Never hand a half-finished transaction to the next borrower
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except BaseException:
+                # A connection that can't roll back is discarded, not reused
+                broken, conn = conn, None
+                broken.close()
+                raise
+            finally:
+                self._connections.put(conn)
+
+# SQLite allows many readers but only one writer, so writes go through a
+# single connection while reads get their own read-only pool
+writer_pool = ConnectionPool(f'file:{DATABASE_PATH}?mode=rwc', 1, SQLITE_WRITER_PRAGMAS)
+reader_pool = ConnectionPool(f'file:{DATABASE_PATH}?mode=ro', DB_POOL_SIZE, SQLITE_PRAGMAS)
+
+# Navigation logs waiting for the background writer thread
+navigation_log_queue = queue.Queue()
+
+# AR overlay grid, rebuilt by load_poi_cache(): maps a grid cell to the POI rows
+# that may lie within AR_OVERLAY_RADIUS of a point in it, plus an (n, 4) array
+# of their (lat_rad, lon_rad, cos_lat, sin_lat) terms
+POI_CACHE = {}
 
 # Initialize database
 def init_db():
-    conn = sqlite3.connect('pathvision.db')
-    cursor = conn.cursor()
-    
-    # Create tables
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS pois (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            category TEXT, 
-            latitude REAL,
-            longitude REAL,
-            description TEXT,
-            indoor_map TEXT
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS navigation_logs (
-            id INTEGER PRIMARY KEY,
-            user_id TEXT,
-            start_location TEXT,
-            end_location TEXT,
-            timestamp DATETIME,
-            route_data TEXT
-        )
-    ''')
-    
-    # Insert sample POIs
-    sample_pois = [
-        ('Main Entrance', 'entrance', 18.5204, 73.8567, 'Primary building entrance', 'floor_1_map.json'),
-        ('Cafeteria', 'dining', 18.5210, 73.8575, 'Student dining area', 'floor_2_map.json'),
-        ('Library', 'education', 18.5215, 73.8580, 'Central library', 'floor_3_map.json'),
-        ('Restroom', 'facilities', 18.5200, 73.8560, 'Public restroom facilities', 'floor_1_map.json'),
-        ('Information Desk', 'service', 18.5208, 73.8570, 'Help and information', 'floor_1_map.json'),
-        ('Parking Area', 'parking', 18.5195, 73.8550, 'Vehicle parking zone', 'ground_map.json'),
-        ('Emergency Exit', 'safety', 18.5212, 73.8565, 'Emergency evacuation route', 'floor_1_map.json'),
-        ('Conference Hall', 'meeting', 18.5218, 73.8585, 'Large meeting space', 'floor_2_map.json')
-    ]
-    
-    cursor.executemany('''
-        INSERT OR REPLACE INTO pois (name, category, latitude, longitude, description, indoor_map)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', sample_pois)
-    
-    conn.commit()
-    conn.close()
+    with writer_pool.connect() as conn:
+        # Create and seed everything in a single transaction (one fsync)
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.cursor()
+    
+        # Create tables
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pois (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                category TEXT, 
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                description TEXT,
+                indoor_map TEXT
+            )
+        ''')
+        
+        # Spatial index over POI coordinates, kept in sync by triggers
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS pois_rtree
+            USING rtree(id, minLat, maxLat, minLon, maxLon)
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS pois_rtree_insert AFTER INSERT ON pois
+            WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL
+            BEGIN
+                INSERT OR REPLACE INTO pois_rtree
+                VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS pois_rtree_update AFTER UPDATE OF latitude, longitude ON pois
+            BEGIN
+                DELETE FROM pois_rtree WHERE id = old.id;
+                INSERT INTO pois_rtree
+                SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+                WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS pois_rtree_delete AFTER DELETE ON pois
+            BEGIN
+                DELETE FROM pois_rtree WHERE id = old.id;
+            END
+        ''')
+        
+        # Index POIs stored before the R-tree existed
+        cursor.execute('''
+            INSERT INTO pois_rtree
+            SELECT id, latitude, latitude, longitude, longitude FROM pois
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+              AND id NOT IN (SELECT id FROM pois_rtree)
+        ''')
+    
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS navigation_logs (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT,
+                start_location TEXT,
+                end_location TEXT,
+                timestamp DATETIME,
+                route_data TEXT,
+                route_blob BLOB
+            )
+        ''')
+        
+        # Databases created before route_blob existed keep their old JSON text
+        # in route_data; new rows store orjson bytes in route_blob instead
+        log_columns = {column[1] for column in cursor.execute('PRAGMA table_info(navigation_logs)')}
+        if 'route_blob' not in log_columns:
+            cursor.execute('ALTER TABLE navigation_logs ADD COLUMN route_blob BLOB')
+        
+        # Lets GROUP BY end_location aggregates, such as the dest_counts backfill, walk an index
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_end ON navigation_logs(end_location)')
+        
+        # Running analytics counters, updated alongside each batch of logs
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dest_counts'")
+        counters_exist = cursor.fetchone() is not None
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS dest_counts (
+                end_location TEXT PRIMARY KEY NOT NULL,
+                count INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_dest_counts_count ON dest_counts(count)')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS navigation_stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        
+        # Seed the counters from logs written before they existed
+        if not counters_exist:
+            cursor.execute('''
+                INSERT INTO dest_counts (end_location, count)
+                SELECT end_location, COUNT(*) FROM navigation_logs
+                WHERE end_location IS NOT NULL
+                GROUP BY end_location
+            ''')
+            cursor.execute('''
+                INSERT OR REPLACE INTO navigation_stats (name, value)
+                SELECT 'total_navigations', COUNT(*) FROM navigation_logs
+            ''')
+    
+        # Insert sample POIs, only into an empty table so restarts don't duplicate them
+        sample_pois = [
+            ('Main Entrance', 'entrance', 18.5204, 73.8567, 'Primary building entrance', 'floor_1_map.json'),
+            ('Cafeteria', 'dining', 18.5210, 73.8575, 'Student dining area', 'floor_2_map.json'),
+            ('Library', 'education', 18.5215, 73.8580, 'Central library', 'floor_3_map.json'),
+            ('Restroom', 'facilities', 18.5200, 73.8560, 'Public restroom facilities', 'floor_1_map.json'),
+            ('Information Desk', 'service', 18.5208, 73.8570, 'Help and information', 'floor_1_map.json'),
+            ('Parking Area', 'parking', 18.5195, 73.8550, 'Vehicle parking zone', 'ground_map.json'),
+            ('Emergency Exit', 'safety', 18.5212, 73.8565, 'Emergency evacuation route', 'floor_1_map.json'),
+            ('Conference Hall', 'meeting', 18.5218, 73.8585, 'Large meeting space', 'floor_2_map.json')
+        ]
+    
+        cursor.execute('SELECT COUNT(*) FROM pois')
+        if cursor.fetchone()[0] == 0:
+            cursor.executemany('''
+                INSERT INTO pois (name, category, latitude, longitude, description, indoor_map)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', sample_pois)
+    
+        conn.commit()
+
+def load_poi_cache():
+    """Precompute the AR overlay grid and POI trig terms; call after changing the pois table"""
+    global POI_CACHE
+    with reader_pool.connect() as conn:
+        pois = conn.execute('''
+            SELECT id, name, category, latitude, longitude, description FROM pois
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        ''').fetchall()
+    
+    # Register each POI in every cell its radius box touches, so a single cell
+    # lookup finds all POIs in range. The 1% padding absorbs the small change in
+    # longitude scale between the POI's latitude and the user's
+    cell_pois = {}
+    for poi in pois:
+        min_lat, max_lat, min_lon, max_lon = bounding_box(
+            poi['latitude'], poi['longitude'], AR_OVERLAY_RADIUS * 1.01)
+        min_row, min_col = grid_cell(min_lat, min_lon)
+        max_row, max_col = grid_cell(max_lat, max_lon)
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                cell_pois.setdefault((row, col), []).append(poi)
+    
+    POI_CACHE = {
+        cell: (candidates, np.array([poi_trig(poi['latitude'], poi['longitude']) for poi in candidates]))
+        for cell, candidates in cell_pois.items()
+    }
 
 # API Routes
 @app.route('/api/pois', methods=['GET'])
+@cache.cached(timeout=30, query_string=True)
 def get_pois():
     """Get all Points of Interest"""
     category = request.args.get('category', '')
@@ -70,39 +318,47 @@ def get_pois():
     lon = request.args.get('lon', type=float)
     radius = request.args.get('radius', 1000, type=int)  # meters
     
-    conn = sqlite3.connect('pathvision.db')
-    cursor = conn.cursor()
-    
-    query = 'SELECT * FROM pois'
+    query = SQL_POI_SELECT
+    conditions = []
     params = []
     
+    # Restrict to the radius around the user location via the R-tree
+    if lat and lon:
+        query += ' JOIN pois_rtree r ON p.id = r.id'
+        conditions.append(RTREE_BOX_FILTER)
+        params.extend(bounding_box(lat, lon, radius))
+    
     if category:
-        query += ' WHERE category = ?'
+        conditions.append('p.category = ?')
         params.append(category)
     
-    cursor.execute(query, params)
-    pois = cursor.fetchall()
-    conn.close()
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    
+    with reader_pool.connect() as conn:
+        pois = conn.execute(query, params).fetchall()
     
     poi_list = []
     for poi in pois:
         poi_data = {
-            'id': poi[0],
-            'name': poi[1],
-            'category': poi[2],
-            'latitude': poi[3],
-            'longitude': poi[4],
-            'description': poi[5],
-            'indoor_map': poi[6]
+            'id': poi['id'],
+            'name': poi['name'],
+            'category': poi['category'],
+            'latitude': poi['latitude'],
+            'longitude': poi['longitude'],
+            'description': poi['description'],
+            'indoor_map': poi['indoor_map']
         }
         
         # Calculate distance if user location provided
         if lat and lon:
-            poi_data['distance'] = calculate_distance(lat, lon, poi[3], poi[4])
+            poi_data['distance'] = calculate_distance(lat, lon, poi['latitude'], poi['longitude'])
+            if poi_data['distance'] > radius:
+                continue
         
         poi_list.append(poi_data)
     
-    return jsonify({'pois': poi_list})
+    return ojsonify({'pois': poi_list})
 
 @app.route('/api/route', methods=['POST'])
 def get_route():
@@ -115,26 +371,14 @@ def get_route():
     if not start or not end:
         return jsonify({'error': 'Start and end coordinates required'}), 400
     
-    # Build Mapbox API request
-    coordinates = f"{start[0]},{start[1]};{end[0]},{end[1]}"
-    url = f"https://api.mapbox.com/directions/v5/mapbox/{profile}/{coordinates}"
-    
-    params = {
-        'access_token': MAPBOX_ACCESS_TOKEN,
-        'geometries': 'geojson',
-        'overview': 'full',
-        'steps': 'true',
-        'voice_instructions': 'true'
-    }
-    
     try:
-        response = requests.get(url, params=params)
-        route_data = response.json()
+        # Canonical keys round to 5 decimals (~1m), so nearby requests share a cached route
+        route_data = fetch_route(start, end, profile)
         
         # Log navigation request
         log_navigation(data.get('user_id', 'anonymous'), start, end, route_data)
         
-        return jsonify(route_data)
+        return ojsonify(route_data)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -170,60 +414,61 @@ def get_ar_overlay():
     lon = data.get('longitude')
     heading = data.get('heading', 0)  # Device compass heading
     
-    # Find nearby POIs for AR overlay
-    conn = sqlite3.connect('pathvision.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM pois')
-    all_pois = cursor.fetchall()
-    conn.close()
-    
-    ar_objects = []
-    for poi in all_pois:
-        distance = calculate_distance(lat, lon, poi[3], poi[4])
-        if distance < 100:  # Within 100 meters
-            ar_objects.append({
-                'name': poi[1],
-                'category': poi[2],
-                'distance': round(distance, 1),
-                'bearing': calculate_bearing(lat, lon, poi[3], poi[4]),
-                'description': poi[5]
-            })
-    
-    return jsonify({'ar_objects': ar_objects})
+    # Find nearby POIs for AR overlay: only POIs registered in the user's grid
+    # cell can be in range, so just those get the exact distance check
+    candidates, trig = POI_CACHE.get(grid_cell(lat, lon), ([], np.empty((0, 4))))
+    
+    lat_rad, lon_rad, cos_lat, sin_lat = poi_trig(lat, lon)
+    distances = calculate_distance_fast(lat_rad, lon_rad, cos_lat, trig[:, 0], trig[:, 1])
+    
+    # Bearings only for the POIs within range, in one pass over the survivors
+    nearby = np.flatnonzero(distances < AR_OVERLAY_RADIUS)
+    delta_lon = trig[nearby, 1] - lon_rad
+    poi_cos_lat = trig[nearby, 2]
+    y = np.sin(delta_lon) * poi_cos_lat
+    x = cos_lat * trig[nearby, 3] - sin_lat * poi_cos_lat * np.cos(delta_lon)
+    bearings = (np.degrees(np.arctan2(y, x)) + 360) % 360
+    
+    ar_objects = [
+        {
+            'name': candidates[i]['name'],
+            'category': candidates[i]['category'],
+            'distance': round(float(distances[i]), 1),
+            'bearing': float(bearing),
+            'description': candidates[i]['description']
+        }
+        for i, bearing in zip(nearby, bearings)
+    ]
+    
+    return ojsonify({'ar_objects': ar_objects})
 
 @app.route('/api/analytics', methods=['GET'])
+@cache.cached(timeout=60, key_prefix='analytics')
 def get_analytics():
     """Get navigation analytics"""
-    conn = sqlite3.connect('pathvision.db')
-    cursor = conn.cursor()
-    
-    # Get popular destinations
-    cursor.execute('''
-        SELECT end_location, COUNT(*) as count 
-        FROM navigation_logs 
-        GROUP BY end_location 
-        ORDER BY count DESC 
-        LIMIT 5
-    ''')
-    popular_destinations = cursor.fetchall()
-    
-    # Get usage statistics
-    cursor.execute('SELECT COUNT(*) FROM navigation_logs')
-    total_navigations = cursor.fetchone()[0]
-    
-    conn.close()
+    with reader_pool.connect() as conn:
+        cursor = conn.cursor()
+        
+        # Get popular destinations
+        cursor.execute(SQL_POPULAR_DESTINATIONS)
+        popular_destinations = cursor.fetchall()
+        
+        # Get usage statistics
+        cursor.execute(SQL_TOTAL_NAVIGATIONS)
+        total_navigations = cursor.fetchone()[0]
     
     return jsonify({
         'total_navigations': total_navigations,
-        'popular_destinations': [{'destination': dest[0], 'count': dest[1]} for dest in popular_destinations]
+        'popular_destinations': [{'destination': dest['end_location'], 'count': dest['count']} for dest in popular_destinations]
     })
 
 # Utility Functions
+def ojsonify(data):
+    """Build a JSON response with orjson, which serializes large payloads faster than jsonify"""
+    return Response(orjson.dumps(data), mimetype='application/json')
+
 def calculate_distance(lat1, lon1, lat2, lon2):
     """Calculate distance between two coordinates in meters"""
-    import math
-    R = 6371000  # Earth's radius in meters
-    
     lat1_rad = math.radians(lat1)
     lat2_rad = math.radians(lat2)
     delta_lat = math.radians(lat2 - lat1)
@@ -234,40 +479,105 @@ def calculate_distance(lat1, lon1, lat2, lon2):
          math.sin(delta_lon/2) * math.sin(delta_lon/2))
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
     
-    return R * c
+    return EARTH_RADIUS * c
+
+def poi_trig(lat, lon):
+    """Calculate the (lat_rad, lon_rad, cos_lat, sin_lat) terms reused by distance and bearing"""
+    lat_rad = math.radians(lat)
+    return lat_rad, math.radians(lon), math.cos(lat_rad), math.sin(lat_rad)
 
-def calculate_bearing(lat1, lon1, lat2, lon2):
-    """Calculate bearing between two coordinates"""
-    import math
+def calculate_distance_fast(lat_rad, lon_rad, cos_lat, lats_rad, lons_rad):
+    """Approximate short-range distances in meters from one point to arrays of points (radians)"""
+    # Equirectangular projection: the earth is effectively flat across the AR overlay radius
+    return EARTH_RADIUS * np.hypot((lons_rad - lon_rad) * cos_lat, lats_rad - lat_rad)
+
+def bounding_box(lat, lon, radius):
+    """Calculate the lat/lon box enclosing a radius in meters around a coordinate"""
+    dlat = math.degrees(radius / EARTH_RADIUS)
+    dlon = dlat / math.cos(math.radians(lat))
     
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lon = math.radians(lon2 - lon1)
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+def grid_cell(lat, lon):
+    """Get the AR overlay grid cell containing a coordinate"""
+    return math.floor(lat / AR_GRID_CELL_DEGREES), math.floor(lon / AR_GRID_CELL_DEGREES)
+
+def round_coordinate(point):
+    """Round a [longitude, latitude] pair to ~1m precision"""
+    return tuple(round(float(value), 5) for value in point)
+
+def canonical_location(point):
+    """Format a [longitude, latitude] pair as a compact 'lon,lat' key at ~1m precision"""
+    return ','.join(str(value) for value in round_coordinate(point))
+
+def fetch_route(start, end, profile):
+    """Fetch a Mapbox route, reusing recent successful responses"""
+    coordinates = f"{canonical_location(start)};{canonical_location(end)}"
+    cache_key = f'route/{profile}/{coordinates}'
+    route_data = cache.get(cache_key)
+    if route_data is not None:
+        return route_data
     
-    y = math.sin(delta_lon) * math.cos(lat2_rad)
-    x = (math.cos(lat1_rad) * math.sin(lat2_rad) -
-         math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(delta_lon))
+    # Build Mapbox API request
+    url = f"https://api.mapbox.com/directions/v5/mapbox/{profile}/{coordinates}"
     
-    bearing = math.atan2(y, x)
-    return (math.degrees(bearing) + 360) % 360
-
-def log_navigation(user_id, start, end, route_data):
-    """Log navigation request for analytics"""
-    conn = sqlite3.connect('pathvision.db')
-    cursor = conn.cursor()
+    params = {
+        'access_token': MAPBOX_ACCESS_TOKEN,
+        'geometries': 'geojson',
+        'overview': 'full',
+        'steps': 'true',
+        'voice_instructions': 'true'
+    }
+    
+    response = MAPBOX_SESSION.get(url, params=params, timeout=MAPBOX_TIMEOUT)
+    route_data = response.json()
     
-    cursor.execute('''
-        INSERT INTO navigation_logs (user_id, start_location, end_location, timestamp, route_data)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, str(start), str(end), datetime.now(), json.dumps(route_data)))
+    # Error responses are passed through but never cached
+    if response.ok:
+        cache.set(cache_key, route_data, timeout=ROUTE_CACHE_TIMEOUT)
     
-    conn.commit()
-    conn.close()
+    return route_data
+
+def log_navigation(user_id, start, end, route_data):
+    """Queue navigation request for analytics without blocking on the database"""
+    # Canonical keys let nearby endpoints aggregate under one popular destination
+    navigation_log_queue.put((user_id, canonical_location(start), canonical_location(end),
+                              datetime.now(), orjson.dumps(route_data)))
+
+def navigation_log_writer():
+    """Drain queued navigation logs, inserting each batch in one transaction"""
+    while True:
+        batch = [navigation_log_queue.get()]
+        deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(navigation_log_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        
+        try:
+            with writer_pool.connect() as conn:
+                conn.executemany(SQL_INSERT_LOG, batch)
+                conn.executemany(SQL_ADD_DEST_COUNT, Counter(entry[2] for entry in batch).items())
+                conn.execute(SQL_ADD_TOTAL_NAVIGATIONS, (len(batch),))
+                conn.commit()
+        except Exception:
+            # Keep the writer alive; a lost batch must not stop later logging
+            app.logger.exception('Failed to write %d navigation logs', len(batch))
+            continue
+        
+        # Cached analytics no longer reflect the logs
+        cache.delete('analytics')
 
 # Initialize database on startup
 init_db()
+load_poi_cache()
+threading.Thread(target=navigation_log_writer, name='navigation-log-writer', daemon=True).start()
 
+# Development server only; in production run under gunicorn so requests are
+# served concurrently by the connection pools:
+#   gunicorn -w 4 --threads 8 --worker-class gthread -b 0.0.0.0:5000 AR_backend:app
 if __name__ == '__main__':
     print("Starting PathVisioN AR Navigation Backend...")
     print("Features: AR overlays, indoor positioning, POI management")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1')